@@ -3,7 +3,8 @@
 # Glue
 #
 # table.load.votable, table.load.fits, and image.load.fits: load data if not
-# already loaded (based on table-id or image-id)
+# already loaded (based on table-id or image-id, or optionally on a fingerprint
+# of the file contents)
 #
 # table.select.rowList: update subset or create new subset based on currently
 #                       selected subset in glue (as if external application was
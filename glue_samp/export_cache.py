@@ -0,0 +1,130 @@
+from __future__ import print_function, division, absolute_import
+
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+
+from glue.core.component import CategoricalComponent
+
+from glue_samp.image_export import data_wcs
+
+__all__ = ['data_key', 'data_fingerprint', 'values_equal', 'cached_export']
+
+# The details of the last export of a dataset are stored in Data.meta so that
+# they are saved and restored along with glue sessions.
+EXPORT_FILENAME = 'samp-export-filename'
+EXPORT_KEY = 'samp-export-key'
+EXPORT_STAT = 'samp-export-stat'
+
+
+def _update(md5, values):
+    values = np.ascontiguousarray(values)
+    md5.update(str((values.dtype.str, values.shape)).encode('utf-8'))
+    if values.dtype.kind == 'O':
+        values = values.astype(str)
+    md5.update(values.tobytes())
+
+
+def data_key(data, fmt=''):
+    """
+    Return a hash of the format, shape, coordinates, and component names,
+    types and units of a dataset, which is cheap to compute but does not
+    depend on the values.
+    """
+
+    md5 = hashlib.md5()
+    md5.update(str((fmt, data.shape)).encode('utf-8'))
+
+    wcs = data_wcs(data)
+    if wcs is not None:
+        md5.update(wcs.to_header_string().encode('utf-8'))
+
+    for cid in data.main_components + data.derived_components:
+        component = data.get_component(cid)
+        md5.update(str((cid.label, type(component).__name__,
+                        getattr(component, 'units', None))).encode('utf-8'))
+
+    return md5.hexdigest()
+
+
+def data_fingerprint(data, fmt=''):
+    """
+    Return a hash of the values of a dataset, as well as everything included
+    in `data_key`.
+    """
+
+    md5 = hashlib.md5()
+    md5.update(data_key(data, fmt=fmt).encode('utf-8'))
+
+    for cid in data.main_components + data.derived_components:
+        component = data.get_component(cid)
+        if isinstance(component, CategoricalComponent):
+            _update(md5, component.codes)
+            _update(md5, component.categories)
+        else:
+            _update(md5, data[cid])
+
+    return md5.hexdigest()
+
+
+def values_equal(values1, values2):
+    """
+    Return whether two arrays have the same shape and values, treating NaN
+    values as equal and comparing strings and objects as strings.
+    """
+    values1, values2 = np.asarray(values1), np.asarray(values2)
+    if values1.shape != values2.shape:
+        return False
+    if values1.dtype.kind in 'OSU' or values2.dtype.kind in 'OSU':
+        return np.all(values1.astype(str) == values2.astype(str))
+    equal = values1 == values2
+    if values1.dtype.kind in 'fc' and values2.dtype.kind in 'fc':
+        equal |= np.isnan(values1) & np.isnan(values2)
+    return bool(np.all(equal))
+
+
+def _file_stat(filename):
+    stat = os.stat(filename)
+    return '{0}:{1!r}'.format(stat.st_size, stat.st_mtime)
+
+
+def cached_export(data, writer, fmt, unchanged=False, compare=None):
+    """
+    Return the name of a file containing ``data`` exported to format ``fmt``.
+
+    If the dataset has already been exported to this format, the data has not
+    changed since, and the file still exists unmodified, the existing file is
+    returned. Otherwise ``writer(filename, data)`` is called to write out a
+    new file.
+
+    Only `data_key` is recorded when writing out a file, since hashing the
+    values of large datasets can take longer than writing them out. If
+    ``unchanged`` is `True`, the caller guarantees that the values have not
+    changed since the last call, and only `data_key` is checked. Otherwise,
+    if ``compare`` is given, ``compare(filename, data)`` should return whether
+    the values in the existing file are the same as those in ``data`` (for
+    example when sending data from a restored session), and if ``compare`` is
+    not given, a new file is always written.
+    """
+
+    key = data_key(data, fmt=fmt)
+
+    filename = data.meta.get(EXPORT_FILENAME)
+
+    if (filename is not None and
+            data.meta.get(EXPORT_KEY) == key and
+            os.path.exists(filename) and
+            data.meta.get(EXPORT_STAT) == _file_stat(filename)):
+        if unchanged or (compare is not None and compare(filename, data)):
+            return filename
+
+    filename = tempfile.mktemp()
+    writer(filename, data)
+
+    data.meta[EXPORT_FILENAME] = filename
+    data.meta[EXPORT_KEY] = key
+    data.meta[EXPORT_STAT] = _file_stat(filename)
+
+    return filename
@@ -0,0 +1,108 @@
+from __future__ import print_function, division, absolute_import
+
+import os
+import hashlib
+
+try:
+    from urllib.parse import urlparse
+    from urllib.request import url2pathname
+except ImportError:  # Python 2.7
+    from urlparse import urlparse
+    from urllib import url2pathname
+
+from astropy.io import fits
+
+__all__ = ['url_fingerprint']
+
+# The amount of data read from the start and the end of large files
+CHUNK_SIZE = 2 ** 20
+
+# The number and size of the chunks read from the rest of large files
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 2 ** 16
+
+# The maximum amount of data read when looking for the end of a VOTable header
+MAX_VOTABLE_HEADER_SIZE = 2 ** 24
+
+
+def _sample_offsets(size):
+    """
+    Return the offsets of the chunks read between the start and the end of a
+    file of ``size`` bytes, spread evenly across the file.
+    """
+    start, end = CHUNK_SIZE, size - CHUNK_SIZE - SAMPLE_SIZE
+    if end <= start:
+        return []
+    step = (end - start) / float(SAMPLE_COUNT - 1)
+    return [start + int(round(index * step)) for index in range(SAMPLE_COUNT)]
+
+
+def _header_block(f, head):
+    """
+    Return the header block of FITS and VOTable files - for FITS files this
+    includes the headers of all HDUs.
+    """
+
+    if head.startswith(b'SIMPLE  ='):
+        f.seek(0)
+        with fits.open(f) as hdulist:
+            return ''.join(hdu.header.tostring() for hdu in hdulist).encode('utf-8')
+
+    if b'<VOTABLE' in head:
+        f.seek(0)
+        header = b''
+        while len(header) < MAX_VOTABLE_HEADER_SIZE:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            header += chunk
+            if b'<DATA' in header:
+                return header[:header.index(b'<DATA')]
+        return header
+
+    return b''
+
+
+def url_fingerprint(url, mtype=''):
+    """
+    Return a fingerprint for the dataset at ``url``.
+
+    For local files, the fingerprint depends on the file size, on the contents
+    of the start and end of the file and of a few chunks spread across the
+    rest of the file, and on the header block of FITS and VOTable files, so
+    that the same file sent from different locations has the same fingerprint,
+    without having to read in large files in full. This is a heuristic - large
+    files that only differ in parts that are not read have the same
+    fingerprint. For other URLs, the fingerprint depends on the URL. The
+    fingerprint also depends on ``mtype``, the SAMP message type used to send
+    the dataset.
+    """
+
+    md5 = hashlib.md5()
+    md5.update(mtype.encode('utf-8'))
+
+    parsed = urlparse(url)
+
+    if parsed.scheme == 'file':
+        filename = url2pathname(parsed.path)
+        size = os.path.getsize(filename)
+        md5.update(str(size).encode('utf-8'))
+        with open(filename, 'rb') as f:
+            head = f.read(CHUNK_SIZE)
+            md5.update(head)
+            if size > 2 * CHUNK_SIZE:
+                for offset in _sample_offsets(size):
+                    f.seek(offset)
+                    md5.update(f.read(SAMPLE_SIZE))
+                f.seek(-CHUNK_SIZE, os.SEEK_END)
+            md5.update(f.read())
+            try:
+                md5.update(_header_block(f, head))
+            except Exception:
+                # Files that look like FITS or VOTable files but can't be
+                # parsed are still fingerprinted based on the chunks above
+                pass
+    else:
+        md5.update(url.encode('utf-8'))
+
+    return md5.hexdigest()
@@ -0,0 +1,205 @@
+from __future__ import print_function, division, absolute_import
+
+import warnings
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from glue.logger import logger
+
+__all__ = ['image_writer', 'downsample_factor', 'DOWNSAMPLE_METHODS']
+
+DOWNSAMPLE_METHODS = ['block', 'stride']
+
+# Approximate number of input values to block-average at a time
+BLOCK_CHUNK_SIZE = 2 ** 22
+
+
+def data_wcs(data):
+    """
+    Return the `~astropy.wcs.WCS` attached to a dataset, or `None`.
+    """
+    coords = data.coords
+    if not isinstance(coords, WCS):
+        # Older versions of glue wrap the WCS in a WCSCoordinates object
+        coords = getattr(coords, 'wcs', None)
+    if isinstance(coords, WCS) and coords.naxis == data.ndim:
+        return coords
+    else:
+        return None
+
+
+def downsample_factor(shape, max_size):
+    """
+    Return the smallest integer factor that brings all dimensions in ``shape``
+    down to at most ``max_size`` pixels.
+    """
+    if max_size is None:
+        return 1
+    return max(1, int(np.ceil(max(shape) / float(max_size))))
+
+
+def _block_average(values, factors):
+
+    ny, nx = values.shape[0] // factors[0], values.shape[1] // factors[1]
+
+    # Floating-point values keep their precision, everything else is
+    # averaged as 64-bit floats
+    if values.dtype.kind == 'f':
+        dtype = values.dtype
+    else:
+        dtype = np.dtype(float)
+
+    result = np.empty((ny, nx), dtype=dtype)
+
+    # Average a few rows of blocks at a time to avoid making temporary copies
+    # of the whole image.
+    rows = max(1, BLOCK_CHUNK_SIZE // max(1, factors[0] * values.shape[1]))
+
+    with warnings.catch_warnings():
+        # Blocks that only contain NaN values are expected
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for start in range(0, ny, rows):
+            end = min(ny, start + rows)
+            chunk = values[start * factors[0]:end * factors[0]].astype(dtype, copy=False)
+            chunk = chunk.reshape((end - start, factors[0], nx, factors[1]))
+            if dtype.kind == 'f' and np.isnan(chunk).any():
+                result[start:end] = np.nanmean(chunk, axis=(1, 3))
+            else:
+                result[start:end] = chunk.mean(axis=(1, 3))
+
+    return result
+
+
+def _resampled_wcs(wcs, offsets, factors, dropped):
+    """
+    Return a copy of ``wcs`` in which pixel ``p`` along each axis corresponds
+    to pixel ``offset + factor * p`` in the original WCS, and where the axes
+    in ``dropped`` have been removed. All arguments are in Numpy order.
+    """
+
+    wcs = wcs.deepcopy()
+
+    if any(factor > 1 for factor in factors):
+        # Distortion terms are not rescaled, so we drop them rather than
+        # writing out incorrect values.
+        wcs.sip = None
+
+    if wcs.wcs.has_cd():
+        matrix = wcs.wcs.cd.copy()
+    else:
+        matrix = wcs.wcs.get_pc().copy()
+
+    for index, (offset, factor) in enumerate(zip(offsets, factors)):
+        iwcs = wcs.wcs.naxis - 1 - index
+        wcs.wcs.crpix[iwcs] = (wcs.wcs.crpix[iwcs] - 1 - offset) / factor + 1
+        matrix[:, iwcs] *= factor
+
+    if wcs.wcs.has_cd():
+        wcs.wcs.cd = matrix
+    else:
+        wcs.wcs.pc = matrix
+
+    naxis = wcs.wcs.naxis
+    for index in sorted(dropped):
+        wcs = wcs.dropaxis(naxis - 1 - index)
+
+    return wcs
+
+
+def image_writer(filename, data, slices=None, max_size=None, method='block'):
+    """
+    Write a two-dimensional image extracted from a dataset to a FITS file.
+
+    Parameters
+    ----------
+    filename : str
+        The file to write to
+    data : `~glue.core.data.Data`
+        The dataset to export
+    slices : tuple, optional
+        One entry per dimension of the dataset, either an integer to select a
+        single plane along that dimension or ``slice(None)`` to keep the
+        dimension. Exactly two dimensions should be kept. This can be omitted
+        for two-dimensional datasets.
+    max_size : int, optional
+        If specified, the image is downsampled by an integer factor so that
+        neither dimension is larger than ``max_size`` pixels.
+    method : { 'block' | 'stride' }
+        How to downsample the image - ``'block'`` averages the values in each
+        block of pixels (ignoring NaN values) and ``'stride'`` keeps only one
+        pixel per block, which avoids reading in the whole image and is much
+        faster for large images.
+    """
+
+    if slices is None:
+        slices = (slice(None),) * data.ndim
+    elif len(slices) != data.ndim:
+        raise ValueError("slices should have one entry per dimension ({0})".format(data.ndim))
+
+    kept = [index for index, item in enumerate(slices) if isinstance(item, slice)]
+    if len(kept) != 2:
+        raise ValueError("slices should keep exactly two dimensions")
+
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError("method should be one of {0}".format('/'.join(DOWNSAMPLE_METHODS)))
+
+    factor = downsample_factor([data.shape[index] for index in kept], max_size)
+
+    view, offsets, factors = [], [], []
+    for index, item in enumerate(slices):
+        if index in kept:
+            # Don't downsample very narrow images down to zero pixels
+            axis_factor = min(factor, data.shape[index])
+            if method == 'block':
+                view.append(slice(0, data.shape[index] // axis_factor * axis_factor))
+                offsets.append((axis_factor - 1) / 2.)
+            else:
+                view.append(slice(None, None, axis_factor))
+                offsets.append(0)
+            factors.append(axis_factor)
+        else:
+            view.append(int(item))
+            offsets.append(int(item))
+            factors.append(1)
+    view = tuple(view)
+
+    header = fits.Header()
+
+    wcs = data_wcs(data)
+    if wcs is not None:
+        dropped = [index for index in range(data.ndim) if index not in kept]
+        try:
+            header = _resampled_wcs(wcs, offsets, factors, dropped).to_header()
+        except Exception:
+            # This can happen for example when dropping one of the celestial
+            # axes, in which case the remaining axes can't be described by a
+            # valid FITS WCS.
+            logger.info('SAMP: could not determine WCS for image slice, '
+                        'sending image without WCS')
+
+    hdus = fits.HDUList()
+
+    for cid in data.main_components + data.derived_components:
+
+        if data.get_kind(cid) != 'numerical':
+            continue
+
+        values = data.get_data(cid, view=view)
+
+        if method == 'block' and factor > 1:
+            values = _block_average(values, [factors[index] for index in kept])
+
+        component_header = header.copy()
+        units = getattr(data.get_component(cid), 'units', None)
+        if units:
+            component_header['BUNIT'] = units
+
+        hdus.append(fits.ImageHDU(values, name=cid.label, header=component_header))
+
+    try:
+        hdus.writeto(filename, overwrite=True)
+    except TypeError:
+        hdus.writeto(filename, clobber=True)
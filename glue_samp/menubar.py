@@ -1,6 +1,13 @@
 from __future__ import print_function, division, absolute_import
 
+from functools import partial
+
+from qtpy.QtCore import QTimer
+
 from glue.config import menubar_plugin
+from glue.logger import logger
+from glue.core.hub import HubListener
+from glue.core.message import ApplicationClosedMessage
 from glue.utils.qt import get_qapp
 
 from glue_samp.samp_state import SAMPState
@@ -8,6 +15,52 @@ from glue_samp.qt.samp_client import QtSAMPClient
 from glue_samp.qt.layer_actions import add_samp_layer_actions
 
 samp_client = None
+samp_menu = None
+
+# Used to listen for the application being closed
+application_listener = HubListener()
+
+
+def _on_application_closed(application, message):
+    # When a saved session is restored, glue creates a new application and
+    # closes the current one. The SAMP ids and export cache are stored in
+    # Data.meta so are restored with the data, and we just need to make sure
+    # the client uses the new session. We do this once the hub has finished
+    # broadcasting the message since we need to unsubscribe from it.
+    #
+    # There is no public API to find the new application, so this relies on
+    # the private _new_application attribute, which
+    # GlueApplication.restore_session_and_close sets before closing the
+    # current application. If it isn't present (because the application is
+    # simply being closed, or because glue no longer sets it), the SAMP menu
+    # needs to be re-opened to switch to the new session.
+    new_application = getattr(application, '_new_application', None)
+    if new_application is None:
+        logger.info('SAMP: application closed without a new application - if a '
+                    'session was restored, re-open the SAMP plugin to use it')
+    else:
+        QTimer.singleShot(0, partial(_attach_session, new_application.session))
+
+
+def _attach_session(session):
+
+    global samp_menu
+
+    samp_client.set_session(session)
+
+    # The SAMP menu for the previous application is no longer needed
+    if samp_menu is not None:
+        samp_client.state.remove_callback('clients', samp_menu.update_clients)
+
+    # We now add actions to the data collection - however we don't use
+    # the @layer_action framework because we want to be able to add
+    # sub-menus. TODO: expand @layer_action framework to allow sub-menus.
+
+    samp_menu = add_samp_layer_actions(session, samp_client)
+
+    session.data_collection.hub.subscribe(application_listener, ApplicationClosedMessage,
+                                          handler=partial(_on_application_closed,
+                                                          session.application))
 
 
 @menubar_plugin("Open SAMP plugin")
@@ -18,16 +71,19 @@ def samp_plugin(session, data_collection):
     if samp_client is None:
 
         state = SAMPState()
-        samp_client = QtSAMPClient(state=state, data_collection=data_collection)
+        samp_client = QtSAMPClient(state=state, session=session)
 
-        # We now add actions to the data collection - however we don't use
-        # the @layer_action framework because we want to be able to add
-        # sub-menus. TODO: expand @layer_action framework to allow sub-menus.
+        _attach_session(session)
 
-        add_samp_layer_actions(session, samp_client)
+        app = get_qapp()
+        app.aboutToQuit.connect(samp_client.stop_samp)
+
+    elif samp_client.session is not session:
+
+        # This can happen if the client could not automatically switch to a
+        # restored session.
+
+        _attach_session(session)
 
     samp_client.show()
     samp_client.raise_()
-
-    app = get_qapp()
-    app.aboutToQuit.connect(samp_client.stop_samp)
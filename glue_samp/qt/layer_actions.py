@@ -1,11 +1,17 @@
 from functools import partial
 
 from qtpy import QtWidgets
+from qtpy.QtCore import Qt
 
+from glue.core import Data
+from glue.utils import nonpartial
 from glue.app.qt.layer_tree_widget import LayerAction
 
 __all__ = ['add_samp_layer_actions']
 
+# Maximum size in pixels of image previews
+PREVIEW_SIZE = 2048
+
 
 class SAMPAction(LayerAction):
 
@@ -21,7 +27,7 @@ class SAMPAction(LayerAction):
     def _can_trigger(self):
         if self.single_selection_data():
             layer = self.selected_layers()[0]
-            return layer.ndim == 1 or layer.ndim == 2
+            return layer.ndim >= 1
         elif self.single_selection_subset():
             layer = self.selected_layers()[0]
             return layer.ndim == 1
@@ -31,8 +37,82 @@ class SAMPAction(LayerAction):
     def _do_action(self):
         pass
 
-    def _send_to_samp(self, client=None):
-        self.client.send_data(layer=self.selected_layers()[0], client=client)
+    def _can_preview(self):
+        if self.single_selection_data():
+            return self.selected_layers()[0].ndim >= 2
+        else:
+            return False
+
+    def _viewer_slices(self, data):
+        # Find the slice shown in the first image viewer using this dataset as
+        # reference data, and default to the first plane otherwise.
+        for tab in self.client.session.application.viewers:
+            for viewer in tab:
+                state = viewer.state
+                if getattr(state, 'reference_data', None) is data and getattr(state, 'slices', None):
+                    axes = (state.x_att.axis, state.y_att.axis)
+                    return tuple(slice(None) if index in axes else index_slice
+                                 for index, index_slice in enumerate(state.slices))
+        return (0,) * (data.ndim - 2) + (slice(None),) * 2
+
+    def _send_kwargs(self, layer, preview=False):
+        kwargs = {}
+        if isinstance(layer, Data) and layer.ndim > 2:
+            kwargs['slices'] = self._viewer_slices(layer)
+        if preview:
+            # Previews are meant to be quick to send even for very large
+            # images, so we use strided rather than block-averaged sampling.
+            kwargs['max_size'] = PREVIEW_SIZE
+            kwargs['method'] = 'stride'
+        return kwargs
+
+    def _send_to_samp(self, client=None, preview=False):
+        layer = self.selected_layers()[0]
+        self.client.send_data(layer=layer, client=client,
+                              **self._send_kwargs(layer, preview=preview))
+
+    def _send_to_samp_clients(self, preview=False):
+        dialog = SelectClientsDialog(self.client.state.clients)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted:
+            return
+        clients = dialog.selected_clients()
+        if not clients:
+            return
+        layer = self.selected_layers()[0]
+        results = self.client.send_data_to_clients(layer=layer, clients=clients,
+                                                   **self._send_kwargs(layer, preview=preview))
+        names = dict(self.client.state.clients)
+        failed = ['{0}: {1}'.format(names.get(client, client), error)
+                  for client, (success, error) in sorted(results.items()) if not success]
+        if failed:
+            QtWidgets.QMessageBox.warning(None, 'SAMP',
+                                          'Data could not be sent to some clients:\n\n' +
+                                          '\n'.join(failed))
+
+
+class SelectClientsDialog(QtWidgets.QDialog):
+
+    def __init__(self, clients, parent=None):
+        super(SelectClientsDialog, self).__init__(parent=parent)
+        self.setWindowTitle('Send to SAMP clients')
+        self.list = QtWidgets.QListWidget()
+        self.list.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        for client, name in clients:
+            item = QtWidgets.QListWidgetItem(name)
+            item.setData(Qt.UserRole, client)
+            self.list.addItem(item)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok |
+                                             QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(QtWidgets.QLabel('Select the clients to send the data to:'))
+        layout.addWidget(self.list)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+    def selected_clients(self):
+        return [item.data(Qt.UserRole) for item in self.list.selectedItems()]
 
 
 class SAMPMenu(QtWidgets.QMenu):
@@ -40,15 +120,34 @@ class SAMPMenu(QtWidgets.QMenu):
     def __init__(self, action, *args, **kwargs):
         super(SAMPMenu, self).__init__(*args, **kwargs)
         self.action = action
+        self.preview_menu = None
+        self.aboutToShow.connect(self.update_preview_enabled)
         self.update_clients([])
 
+    def update_preview_enabled(self):
+        if self.preview_menu is not None:
+            self.preview_menu.menuAction().setEnabled(self.action._can_preview())
+
     def update_clients(self, clients):
         self.clear()
+        self.preview_menu = None
         if clients:
             self.addAction('Broadcast to all clients', self.action._send_to_samp)
             for client, name in clients:
                 self.addAction('Send to {0}'.format(name),
                                partial(self.action._send_to_samp, client=client))
+            self.addAction('Send to selected clients...',
+                           nonpartial(self.action._send_to_samp_clients))
+            self.preview_menu = self.addMenu('Send image preview ({0} pixels)'.format(PREVIEW_SIZE))
+            self.preview_menu.addAction('Broadcast to all clients',
+                                        nonpartial(self.action._send_to_samp, preview=True))
+            for client, name in clients:
+                self.preview_menu.addAction('Send to {0}'.format(name),
+                                            nonpartial(self.action._send_to_samp,
+                                                       client=client, preview=True))
+            self.preview_menu.addAction('Send to selected clients...',
+                                        nonpartial(self.action._send_to_samp_clients,
+                                                   preview=True))
         else:
             action = self.addAction('No connected clients')
             action.setEnabled(False)
@@ -58,5 +157,7 @@ def add_samp_layer_actions(session, client):
     layer_tree_widget = session.application._layer_widget
     action = SAMPAction(client, layer_tree_widget)
     menu = action.menu()
+    menu.update_clients(client.state.clients)
     layer_tree_widget.ui.layerTree.addAction(action)
     client.state.add_callback('clients', menu.update_clients)
+    return menu
@@ -47,16 +47,16 @@ class QtSAMPClient(SAMPClient, QtWidgets.QWidget):
 
             self.register()
 
-            self.call_received.connect(self.receive_message)
-            self.notification_received.connect(self.receive_message)
+            self.call_received.connect(self._process_call)
+            self.notification_received.connect(self._process_notification)
 
         else:
 
             self.unregister()
 
             try:
-                self.call_received.disconnect(self.receive_message)
-                self.notification_received.disconnect(self.receive_message)
+                self.call_received.disconnect(self._process_call)
+                self.notification_received.disconnect(self._process_notification)
             except TypeError:
                 pass
 
@@ -65,8 +65,9 @@ class QtSAMPClient(SAMPClient, QtWidgets.QWidget):
         self.ui.text_status.setStyleSheet('color: {0}'.format(color))
 
     def receive_call(self, private_key, sender_id, msg_id, mtype, params, extra):
+        # The reply is sent once the message has been processed in the main
+        # thread, see SAMPClient._process_call
         self.call_received.emit(private_key, sender_id, msg_id, mtype, params, extra)
-        self.client.reply(msg_id, {"samp.status": "samp.ok", "samp.result": {}})
 
     def receive_notification(self, private_key, sender_id, msg_id, mtype, params, extra):
         self.notification_received.emit(private_key, sender_id, msg_id, mtype, params, extra)
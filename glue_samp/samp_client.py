@@ -3,10 +3,21 @@ from __future__ import print_function, division, absolute_import
 import os
 import uuid
 import tempfile
+import weakref
+import threading
+from multiprocessing.pool import ThreadPool
 from fnmatch import fnmatch
 
 import numpy as np
 
+from astropy.io import fits
+from astropy.table import Table
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2.7
+    from Queue import Queue
+
 try:
     from astropy.samp import SAMPClientError, SAMPHubServer, SAMPIntegratedClient, SAMPHubError
 except ImportError:
@@ -14,6 +25,8 @@ except ImportError:
 
 from glue import __version__ as glue_version
 from glue.core import Data
+from glue.core.hub import HubListener
+from glue.core.message import NumericalDataChangedMessage, ComponentsChangedMessage
 from glue.logger import logger
 from glue.core.data_factories.astropy_table import (astropy_tabular_data_votable,
                                                     astropy_tabular_data_fits)
@@ -23,6 +36,10 @@ from glue.core.data_exporters.astropy_table import data_to_astropy_table
 from glue.core.subset import ElementSubsetState
 from glue.external.echo import delay_callback
 
+from glue_samp.image_export import image_writer
+from glue_samp.export_cache import cached_export, values_equal
+from glue_samp.fingerprint import url_fingerprint
+
 
 __all__ = ['SAMPClient']
 
@@ -36,16 +53,84 @@ MTYPES = ['table.load.votable',
           'samp.hub.event.register',
           'samp.hub.event.unregister']
 
+# Maximum number of threads to use when sending data to several clients
+MAX_SEND_THREADS = 8
+
+
+def votable_writer(filename, data):
+    data_to_astropy_table(data).write(filename, format='votable')
+
+
+def votable_matches(filename, data):
+    # Check whether a file written by votable_writer contains the values of
+    # a dataset, ignoring metadata (which is checked by the export cache)
+    table = Table.read(filename, format='votable')
+    cids = data.main_components + data.derived_components
+    if table.colnames != [cid.label for cid in cids]:
+        return False
+    return all(values_equal(table[cid.label], data[cid]) for cid in cids)
+
+
+def fits_matches(filename, data):
+    # Check whether a file written by fits_writer contains the values of a
+    # dataset - there is one HDU per numerical component, in order
+    cids = [cid for cid in data.main_components + data.derived_components
+            if data.get_kind(cid) == 'numerical']
+    with fits.open(filename) as hdulist:
+        if len(hdulist) != len(cids):
+            return False
+        return all(values_equal(hdu.data, data[cid])
+                   for hdu, cid in zip(hdulist, cids))
+
+
+class _DataChangeListener(HubListener):
+
+    # Keep track of datasets that have been exported and have not changed
+    # since. This is a separate object rather than the SAMP client itself
+    # since HubListener.unregister would clash with SAMPClient.unregister.
+
+    def __init__(self):
+        self.unchanged_data = weakref.WeakSet()
+        self.hub = None
+
+    def set_hub(self, hub):
+        if self.hub is not None:
+            self.hub.unsubscribe_all(self)
+        self.hub = hub
+        hub.subscribe(self, NumericalDataChangedMessage, handler=self._on_data_changed)
+        hub.subscribe(self, ComponentsChangedMessage, handler=self._on_data_changed)
+
+    def _on_data_changed(self, message):
+        self.unchanged_data.discard(message.data)
+
 
 class SAMPClient(object):
 
     def __init__(self, state=None, session=None):
         self.state = state
-        self.session = session
-        self.data_collection = session.data_collection
+        self.session = None
+        self._data_listener = _DataChangeListener()
+        self.set_session(session)
         self.hub = SAMPHubServer()
         self.client = SAMPIntegratedClient()
         self.state.add_callback('connected', self.on_connected)
+        self._message_queue = None
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @property
+    def data_collection(self):
+        # This is a property since the session can change when a saved glue
+        # session is restored.
+        return self.session.data_collection
+
+    def set_session(self, session):
+        """
+        Set the glue session that the client should add data to and send data
+        from. This should be called when a saved glue session is restored.
+        """
+        self.session = session
+        self._data_listener.set_hub(session.data_collection.hub)
 
     def start_samp(self):
         if not self.client.is_connected:
@@ -81,6 +166,7 @@ class SAMPClient(object):
         self.state.connected = False
         self.state.status = 'Not connected to SAMP Hub'
         self.state.clients = []
+        self._stop_worker()
 
     def register(self):
         for mtype in MTYPES:
@@ -94,6 +180,39 @@ class SAMPClient(object):
                 self.client.unbind_receive_notification(mtype)
         except (AttributeError, SAMPClientError):
             pass
+        self._stop_worker()
+
+    def _queue_message(self, is_call, args):
+        # Messages are processed in order by a single worker thread so that
+        # the hub and sending applications aren't kept waiting while for
+        # example large tables are read in. The worker is only started once
+        # the first message is received, since sub-classes may process
+        # messages differently.
+        with self._worker_lock:
+            if self._message_queue is None:
+                self._message_queue = Queue()
+                self._worker = threading.Thread(target=self._process_messages,
+                                                args=(self._message_queue,))
+                self._worker.daemon = True
+                self._worker.start()
+            self._message_queue.put((is_call, args))
+
+    def _stop_worker(self):
+        with self._worker_lock:
+            if self._message_queue is not None:
+                self._message_queue.put(None)
+                self._message_queue = None
+
+    def _process_messages(self, message_queue):
+        while True:
+            item = message_queue.get()
+            if item is None:
+                break
+            is_call, args = item
+            if is_call:
+                self._process_call(*args)
+            else:
+                self._process_notification(*args)
 
     def on_connected(self, *args):
         if self.state.connected:
@@ -115,62 +234,205 @@ class SAMPClient(object):
             clients.append((client, metadata.get('samp.name', client)))
         self.state.clients = clients
 
-    def send_data(self, layer=None, client=None):
+    def send_data(self, layer=None, client=None, slices=None, max_size=None, method='block'):
+        """
+        Send a dataset or subset to SAMP clients.
+
+        Parameters
+        ----------
+        layer : `~glue.core.data.Data` or `~glue.core.subset.Subset`
+            The dataset or subset to send
+        client : str, optional
+            The ID of the client to send the data to. If not specified, the
+            data is broadcast to all clients.
+        slices : tuple, optional
+            For images and cubes, the slice to send, as an integer index for
+            each dimension to collapse and ``slice(None)`` for each of the two
+            dimensions to keep. For datasets with more than two dimensions,
+            this defaults to the first plane along the first dimensions.
+        max_size : int, optional
+            For images and cubes, if specified, a preview of the image is sent
+            that is downsampled so that neither dimension exceeds this size.
+        method : { 'block' | 'stride' }
+            The downsampling method to use if ``max_size`` is set (see
+            `~glue_samp.image_export.image_writer`).
+        """
+
+        messages = self._prepare_messages(layer, slices=slices, max_size=max_size, method=method)
+
+        for message in messages:
+            if client is None:
+                self.client.notify_all(message)
+            else:
+                self._notify_if_subscribed(client, message)
+
+    def send_data_to_clients(self, layer=None, clients=None, slices=None,
+                             max_size=None, method='block'):
+        """
+        Send a dataset or subset to several SAMP clients in parallel.
+
+        The data is only written out once, and the clients are then notified
+        concurrently. The parameters are the same as for
+        `~glue_samp.samp_client.SAMPClient.send_data`, except that ``clients``
+        should be a list of client IDs.
+
+        Returns
+        -------
+        results : dict
+            A ``(success, error)`` tuple for each client ID, where ``error``
+            is `None` if the data was sent successfully and otherwise
+            describes why it could not be sent.
+        """
+
+        clients = list(clients or [])
+
+        if not clients:
+            return {}
+
+        messages = self._prepare_messages(layer, slices=slices, max_size=max_size, method=method)
 
-        filename = tempfile.mktemp()
+        if not messages:
+            return dict((client, (False, 'Layer cannot be sent over SAMP'))
+                        for client in clients)
 
-        message = {}
-        message["samp.params"] = {}
+        def send(client):
+            try:
+                for message in messages:
+                    if not self._notify_if_subscribed(client, message):
+                        return client, (False, 'Client is not subscribed to '
+                                               '{0}'.format(message['samp.mtype']))
+                return client, (True, None)
+            except Exception as exc:
+                return client, (False, str(exc))
+
+        pool = ThreadPool(min(len(clients), MAX_SEND_THREADS))
+        try:
+            results = pool.map(send, clients)
+        finally:
+            pool.close()
+            pool.join()
+
+        for client, (success, error) in results:
+            if not success:
+                logger.info('SAMP: could not send data to {0}: {1}'.format(client, error))
+
+        return dict(results)
+
+    def _prepare_messages(self, layer, slices=None, max_size=None, method='block'):
+
+        # Write out the data if needed and return the list of SAMP messages
+        # to send, which is empty if the layer can't be sent over SAMP.
 
         if isinstance(layer, Data):
 
+            message = {}
+            message["samp.params"] = {}
+
+            if layer.ndim > 2 and slices is None:
+                slices = (0,) * (layer.ndim - 2) + (slice(None),) * 2
+
             if layer.ndim == 1:
-                table = data_to_astropy_table(layer)
-                table.write(filename, format='votable')
+                filename = self._cached_export(layer, votable_writer, votable_matches, 'votable')
                 message["samp.mtype"] = "table.load.votable"
                 if 'samp-table-id' not in layer.meta:
                     layer.meta['samp-table-id'] = str(uuid.uuid4())
                 message["samp.params"]['table-id'] = layer.meta['samp-table-id']
-            elif layer.ndim == 2:
-                fits_writer(filename, layer)
+            elif layer.ndim == 2 and slices is None and max_size is None:
+                filename = self._cached_export(layer, fits_writer, fits_matches, 'fits')
                 message["samp.mtype"] = "image.load.fits"
                 if 'samp-image-id' not in layer.meta:
                     layer.meta['samp-image-id'] = str(uuid.uuid4())
                 message["samp.params"]['image-id'] = layer.meta['samp-image-id']
+            elif layer.ndim >= 2:
+                filename = tempfile.mktemp()
+                image_writer(filename, layer, slices=slices,
+                             max_size=max_size, method=method)
+                message["samp.mtype"] = "image.load.fits"
+                # Slices and previews are not the same image as the full
+                # dataset, so we don't re-use the dataset's image-id.
+                message["samp.params"]['image-id'] = str(uuid.uuid4())
             else:
-                return
+                return []
 
             message["samp.params"]['name'] = layer.label
             message["samp.params"]['url'] = 'file://' + os.path.abspath(filename)
 
-        else:
+            return [message]
 
-            message['samp.mtype'] = 'table.select.rowList'
+        elif layer.ndim == 1:
 
-            if layer.ndim == 1:
-                message["samp.params"]['table-id'] = layer.data.meta['samp-table-id']
-                message["samp.params"]['row-list'] = np.nonzero(layer.to_mask())[0].astype(str).tolist()
-            else:
-                return
+            # Tables that were received from several applications with the
+            # same content have one table-id per application (see
+            # _add_id_alias), and each application only knows its own
+            # table-id, so we send the selection once for each of them.
+
+            meta = layer.data.meta
+            table_ids = [meta['samp-table-id']] + meta.get('samp-table-id-aliases', [])
+            row_list = np.nonzero(layer.to_mask())[0].astype(str).tolist()
+
+            messages = []
+            for table_id in table_ids:
+                message = {}
+                message['samp.mtype'] = 'table.select.rowList'
+                message['samp.params'] = {'table-id': table_id, 'row-list': row_list}
+                messages.append(message)
+
+            return messages
 
-        if client is None:
-            self.client.notify_all(message)
         else:
-            # Make sure client is subscribed otherwise an exception is raised
-            subscriptions = self.client.get_subscriptions(client)
-            for mtype in subscriptions:
-                if fnmatch(message['samp.mtype'], mtype):
-                    self.client.notify(client, message)
-                    return
-            else:
-                return
+
+            return []
+
+    def _cached_export(self, data, writer, compare, fmt):
+        # We can only rely on change messages for datasets that are in the
+        # data collection and have been exported in this session - for other
+        # datasets (for example from a restored session) the values are
+        # compared to the cached file to find out whether it can be used.
+        unchanged_data = self._data_listener.unchanged_data
+        filename = cached_export(data, writer, fmt, compare=compare,
+                                 unchanged=data in unchanged_data)
+        if data in self.data_collection:
+            unchanged_data.add(data)
+        return filename
+
+    def _notify_if_subscribed(self, client, message):
+        # Make sure client is subscribed otherwise an exception is raised
+        subscriptions = self.client.get_subscriptions(client)
+        for mtype in subscriptions:
+            if fnmatch(message['samp.mtype'], mtype):
+                self.client.notify(client, message)
+                return True
+        else:
+            return False
 
     def receive_call(self, private_key, sender_id, msg_id, mtype, params, extra):
-        self.receive_message(private_key, sender_id, msg_id, mtype, params, extra)
-        self.client.reply(msg_id, {"samp.status": "samp.ok", "samp.result": {}})
+        self._queue_message(True, (private_key, sender_id, msg_id, mtype, params, extra))
 
     def receive_notification(self, private_key, sender_id, msg_id, mtype, params, extra):
-        self.receive_message(private_key, sender_id, msg_id, mtype, params, extra)
+        self._queue_message(False, (private_key, sender_id, msg_id, mtype, params, extra))
+
+    def _process_call(self, private_key, sender_id, msg_id, mtype, params, extra):
+        try:
+            self.receive_message(private_key, sender_id, msg_id, mtype, params, extra)
+        except Exception as exc:
+            logger.info('SAMP: failed to process message with msg_id={0}: '
+                        '{1}'.format(msg_id, exc))
+            response = {"samp.status": "samp.error",
+                        "samp.error": {"samp.errortxt": str(exc)}}
+        else:
+            response = {"samp.status": "samp.ok", "samp.result": {}}
+        try:
+            self.client.reply(msg_id, response)
+        except Exception as exc:
+            # The hub or the calling application may have gone away
+            logger.info('SAMP: could not reply to message with msg_id={0}: '
+                        '{1}'.format(msg_id, exc))
+
+    def _process_notification(self, private_key, sender_id, msg_id, mtype, params, extra):
+        try:
+            self.receive_message(private_key, sender_id, msg_id, mtype, params, extra)
+        except Exception as exc:
+            logger.info('SAMP: failed to process notification: {0}'.format(exc))
 
     def receive_message(self, private_key, sender_id, msg_id, mtype, params, extra):
 
@@ -185,6 +447,13 @@ class SAMPClient(object):
                             'been read in'.format(params['table-id']))
                 return
 
+            fingerprint = self._content_fingerprint(mtype, params)
+
+            if self._add_id_alias(fingerprint, 'samp-table-id', params['table-id']):
+                logger.info('SAMP: table with table-id={0} has the same content as '
+                            'a table that has already been read in'.format(params['table-id']))
+                return
+
             logger.info('SAMP: loading table with table-id={0}'.format(params['table-id']))
 
             if mtype == 'table.load.votable':
@@ -201,6 +470,9 @@ class SAMPClient(object):
             if 'table-id' in params:
                 data.meta['samp-table-id'] = params['table-id']
 
+            if fingerprint is not None:
+                data.meta['samp-content-fingerprint'] = fingerprint
+
             self.data_collection.append(data)
 
         elif mtype.startswith('image.load'):
@@ -210,6 +482,13 @@ class SAMPClient(object):
                             'been read in'.format(params['image-id']))
                 return
 
+            fingerprint = self._content_fingerprint(mtype, params)
+
+            if self._add_id_alias(fingerprint, 'samp-image-id', params['image-id']):
+                logger.info('SAMP: image with image-id={0} has the same content as '
+                            'an image that has already been read in'.format(params['image-id']))
+                return
+
             logger.info('SAMP: loading image with image-id={0}'.format(params['image-id']))
 
             if mtype == 'image.load.fits':
@@ -224,6 +503,9 @@ class SAMPClient(object):
             if 'image-id' in params:
                 data.meta['samp-image-id'] = params['image-id']
 
+            if fingerprint is not None:
+                data.meta['samp-content-fingerprint'] = fingerprint
+
             self.data_collection.append(data)
 
         elif self.state.highlight_is_selection and mtype == 'table.highlight.row':
@@ -233,7 +515,7 @@ class SAMPClient(object):
 
             data = self.data_from_table_id(params['table-id'])
 
-            subset_state = ElementSubsetState(indices=[params['row']], data=data)
+            subset_state = ElementSubsetState(indices=[int(params['row'])], data=data)
 
             self.session.edit_subset_mode.update(self.data_collection, subset_state)
 
@@ -254,30 +536,57 @@ class SAMPClient(object):
 
             self.update_clients()
 
+    def _content_fingerprint(self, mtype, params):
+        if not self.state.deduplicate_by_content or 'url' not in params:
+            return None
+        try:
+            return url_fingerprint(params['url'], mtype=mtype)
+        except (IOError, OSError) as exc:
+            logger.info('SAMP: could not determine fingerprint for '
+                        '{0}: {1}'.format(params['url'], exc))
+            return None
+
+    def _add_id_alias(self, fingerprint, key, samp_id):
+        # If a dataset with the same content fingerprint has already been
+        # read in, record samp_id as an alias for it and return True.
+        if fingerprint is None:
+            return False
+        for data in self.data_collection:
+            if data.meta.get('samp-content-fingerprint', None) == fingerprint:
+                data.meta.setdefault(key + '-aliases', []).append(samp_id)
+                return True
+        else:
+            return False
+
+    @staticmethod
+    def _has_id(data, key, samp_id):
+        return (data.meta.get(key, None) == samp_id or
+                samp_id in data.meta.get(key + '-aliases', []))
+
     def table_id_exists(self, table_id):
         for data in self.data_collection:
-            if data.meta.get('samp-table-id', None) == table_id:
+            if self._has_id(data, 'samp-table-id', table_id):
                 return True
         else:
             return False
 
     def data_from_table_id(self, table_id):
         for data in self.data_collection:
-            if data.meta.get('samp-table-id', None) == table_id:
+            if self._has_id(data, 'samp-table-id', table_id):
                 return data
         else:
             raise Exception("Table {0} not found".format(table_id))
 
     def image_id_exists(self, image_id):
         for data in self.data_collection:
-            if data.meta.get('samp-image-id', None) == image_id:
+            if self._has_id(data, 'samp-image-id', image_id):
                 return True
         else:
             return False
 
     def data_from_image_id(self, image_id):
         for data in self.data_collection:
-            if data.meta.get('samp-image-id', None) == image_id:
+            if self._has_id(data, 'samp-image-id', image_id):
                 return data
         else:
             raise Exception("image {0} not found".format(image_id))
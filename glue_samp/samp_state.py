@@ -10,3 +10,4 @@ class SAMPState(State):
     connected = CallbackProperty(False)
     clients = CallbackProperty([])
     highlight_is_selection = CallbackProperty(False)
+    deduplicate_by_content = CallbackProperty(False)
@@ -0,0 +1,462 @@
+"""
+Load and soak testing for the SAMP client.
+
+This starts a local SAMP hub, a glue SAMPClient, and a number of synthetic
+SAMP peers which send table loads, highlights and row selections to glue at a
+configurable rate, while other clients register and unregister with the hub
+and glue broadcasts data back to the peers. The result is a summary of the
+throughput, latencies, dropped messages, errors, and optionally the memory
+growth of the glue session. For a long run, use for example::
+
+    python -m glue_samp.tests.load_harness --peers 10 --duration 3600
+
+Tracing memory (with ``--trace-memory``) slows down glue, so it is best to
+measure throughput and latencies, and memory growth, in separate runs.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+import numpy as np
+
+from astropy.table import Table
+
+try:
+    from astropy.samp import SAMPHubServer, SAMPIntegratedClient
+except ImportError:
+    from astropy.vo.samp import SAMPHubServer, SAMPIntegratedClient
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2.7
+    tracemalloc = None
+
+from glue.core import Session
+from glue.core.exceptions import IncompatibleAttribute
+
+from ..samp_state import SAMPState
+from ..samp_client import SAMPClient
+
+__all__ = ['LoadReport', 'run_load_test']
+
+BROADCAST_MTYPES = ['table.load.votable', 'table.select.rowList']
+
+
+class LoadReport(object):
+    """
+    Statistics collected during a load test.
+    """
+
+    def __init__(self, peers=0):
+        self.peers = peers
+        self.duration = 0.
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+        self.broadcasts_sent = 0
+        self.broadcasts_received = 0
+        self.churn = 0
+        self.errors = 0
+        self.memory = []
+        self.n_datasets = 0
+        self._lock = threading.Lock()
+
+    def record_reply(self, latency, success):
+        with self._lock:
+            self.sent += 1
+            if success:
+                self.latencies.append(latency)
+            else:
+                self.failed += 1
+
+    def record_broadcast_received(self):
+        with self._lock:
+            self.broadcasts_received += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    @property
+    def throughput(self):
+        """
+        The number of messages successfully processed per second.
+        """
+        if self.duration == 0:
+            return 0.
+        return len(self.latencies) / self.duration
+
+    @property
+    def dropped_broadcasts(self):
+        """
+        The number of broadcasts from glue that did not reach a peer.
+        """
+        return self.broadcasts_sent * self.peers - self.broadcasts_received
+
+    @property
+    def memory_growth(self):
+        """
+        The change in memory used by the glue session in bytes over the run,
+        or `None` if memory was not traced.
+        """
+        if len(self.memory) < 2:
+            return None
+        return self.memory[-1] - self.memory[0]
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Return a dictionary of reply latency percentiles in seconds.
+        """
+        if not self.latencies:
+            return dict((p, np.nan) for p in percentiles)
+        values = np.percentile(self.latencies, percentiles)
+        return dict(zip(percentiles, values))
+
+    def __str__(self):
+        lines = ['Duration: {0:.1f}s with {1} peers'.format(self.duration, self.peers),
+                 'Messages sent: {0} ({1} failed or timed out)'.format(self.sent, self.failed),
+                 'Throughput: {0:.1f} messages/s'.format(self.throughput)]
+        for percentile, value in sorted(self.latency_percentiles().items()):
+            lines.append('Latency p{0}: {1:.1f}ms'.format(percentile, value * 1000))
+        lines.append('Broadcasts: {0} sent, {1} received, {2} '
+                     'dropped'.format(self.broadcasts_sent, self.broadcasts_received,
+                                      self.dropped_broadcasts))
+        lines.append('Register/unregister cycles: {0}'.format(self.churn))
+        lines.append('Errors in broadcasts and register/unregister cycles: '
+                     '{0}'.format(self.errors))
+        lines.append('Datasets in glue: {0}'.format(self.n_datasets))
+        if self.memory_growth is not None:
+            lines.append('Memory: {0:.1f}MB at start, {1:.1f}MB at end, '
+                         '{2:.1f}MB peak'.format(self.memory[0] / 1e6,
+                                                 self.memory[-1] / 1e6,
+                                                 max(self.memory) / 1e6))
+        return os.linesep.join(lines)
+
+
+def _every(interval, stop, function, report):
+    # Call function at regular intervals until stop is set. Errors are
+    # counted rather than stopping the thread, so that they show up in the
+    # report rather than as a lower rate.
+    next_time = time.time()
+    while not stop.is_set():
+        try:
+            function()
+        except Exception:
+            report.record_error()
+        next_time += interval
+        stop.wait(max(0., next_time - time.time()))
+
+
+class _LockedSAMPClient(SAMPClient):
+
+    # A SAMP client which holds a lock while processing messages, so that
+    # other threads can access the session safely.
+
+    def __init__(self, *args, **kwargs):
+        SAMPClient.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+
+    def receive_message(self, *args):
+        with self.lock:
+            SAMPClient.receive_message(self, *args)
+
+
+def _run_peer(peer, glue_id, table_ids, url, n_rows, rate, timeout, seed, stop, report):
+
+    random = np.random.RandomState(seed)
+
+    def send():
+        table_id = table_ids[random.randint(len(table_ids))]
+        kind = random.randint(3)
+        params = {'table-id': table_id}
+        if kind == 0:
+            mtype = 'table.load.votable'
+            params['url'] = url
+            params['name'] = table_id
+        elif kind == 1:
+            mtype = 'table.highlight.row'
+            params['row'] = str(random.randint(n_rows))
+        else:
+            mtype = 'table.select.rowList'
+            params['row-list'] = random.randint(n_rows, size=10).astype(str).tolist()
+        message = {'samp.mtype': mtype, 'samp.params': params}
+        start = time.time()
+        try:
+            response = peer.call_and_wait(glue_id, message, str(int(timeout)))
+        except Exception:
+            report.record_reply(time.time() - start, False)
+        else:
+            report.record_reply(time.time() - start, response['samp.status'] == 'samp.ok')
+
+    _every(1. / rate, stop, send, report)
+
+
+def _receive(connection, timeout):
+    if not connection.poll(timeout):
+        raise RuntimeError("Timed out while waiting for the peer process")
+    return connection.recv()
+
+
+def _run_peers(connection, peers, table_ids, url, n_rows, rate, churn_rate, timeout):
+
+    # This runs in a separate process so that the memory used by the hub and
+    # the peers doesn't get included in the memory used by glue.
+
+    hub = SAMPHubServer(web_profile=False)
+    hub.start()
+
+    try:
+
+        connection.send('ready')
+        glue_id = connection.recv()
+
+        report = LoadReport(peers=peers)
+
+        def received(private_key, sender_id, msg_id, mtype, params, extra):
+            report.record_broadcast_received()
+
+        clients = []
+        for index in range(peers):
+            client = SAMPIntegratedClient()
+            client.connect()
+            for mtype in BROADCAST_MTYPES:
+                client.bind_receive_notification(mtype, received)
+            clients.append(client)
+
+        def churn():
+            client = SAMPIntegratedClient()
+            client.connect()
+            client.disconnect()
+            report.churn += 1
+
+        stop = threading.Event()
+
+        threads = []
+        for index, client in enumerate(clients):
+            threads.append(threading.Thread(target=_run_peer,
+                                            args=(client, glue_id, table_ids, url, n_rows,
+                                                  rate, timeout, index, stop, report)))
+        threads.append(threading.Thread(target=_every,
+                                        args=(1. / churn_rate, stop, churn, report)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # Glue sends the number of broadcasts it sent once the test is over
+        report.broadcasts_sent = connection.recv()
+
+        stop.set()
+        for thread in threads:
+            thread.join(timeout + 1)
+
+        # Wait for broadcasts that are still being delivered
+        end = time.time() + timeout
+        while report.dropped_broadcasts > 0 and time.time() < end:
+            time.sleep(0.1)
+
+        connection.send(dict(sent=report.sent, failed=report.failed,
+                             latencies=report.latencies,
+                             broadcasts_received=report.broadcasts_received,
+                             churn=report.churn, errors=report.errors))
+
+        for client in clients:
+            client.disconnect()
+
+        # Wait for glue to disconnect before stopping the hub
+        connection.recv()
+
+    finally:
+        hub.stop()
+
+
+def run_load_test(peers=5, duration=10., rate=5., broadcast_rate=1., churn_rate=1.,
+                  n_tables=5, n_rows=1000, timeout=10, trace_memory=False,
+                  memory_interval=1.):
+    """
+    Run a load test against a glue SAMPClient connected to a local hub.
+
+    The hub and the peers run in a separate process, so that the memory
+    measurements only include the glue session.
+
+    Parameters
+    ----------
+    peers : int
+        The number of synthetic SAMP peers sending messages to glue.
+    duration : float
+        The duration of the test in seconds.
+    rate : float
+        The rate at which each peer sends messages to glue, in messages per
+        second. Peers wait for the reply to each message, so the actual rate
+        may be lower if glue is not able to keep up.
+    broadcast_rate : float
+        The rate at which glue broadcasts data to the peers.
+    churn_rate : float
+        The rate at which additional clients register and unregister.
+    n_tables : int
+        The number of distinct tables (by table-id) that peers send to glue.
+    n_rows : int
+        The number of rows in each table.
+    timeout : int
+        The time in seconds after which a call to glue counts as dropped, and
+        the time to wait for broadcasts to be delivered at the end of the run.
+    trace_memory : bool
+        Whether to trace the memory used by the glue session with tracemalloc.
+        This slows down memory allocations in glue, so the throughput and
+        latencies are less representative when this is enabled.
+    memory_interval : float
+        The interval in seconds between memory measurements.
+
+    Returns
+    -------
+    report : `LoadReport`
+    """
+
+    if trace_memory and tracemalloc is None:
+        raise ValueError("Memory tracing requires the tracemalloc module")
+
+    report = LoadReport(peers=peers)
+
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'table.xml')
+    table = Table()
+    table['a'] = np.arange(n_rows)
+    table['b'] = np.random.random(n_rows)
+    table.write(filename, format='votable')
+    url = 'file://' + os.path.abspath(filename)
+
+    table_ids = ['load-test-{0}'.format(index) for index in range(n_tables)]
+
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_peers,
+                                      args=(child_connection, peers, table_ids, url,
+                                            n_rows, rate, churn_rate, timeout))
+    process.daemon = True
+    process.start()
+
+    glue = None
+
+    try:
+
+        assert _receive(connection, 30) == 'ready'
+
+        if trace_memory:
+            tracemalloc.start()
+
+        state = SAMPState()
+        state.highlight_is_selection = True
+        session = Session()
+        session.edit_subset_mode.edit_subset = []
+        session.edit_subset_mode.data_collection = session.data_collection
+
+        glue = _LockedSAMPClient(state=state, session=session)
+        glue.start_samp()
+        glue.register()
+
+        def broadcast():
+            # The datasets and subsets are changed by the message worker, so
+            # we don't access them while messages are being processed.
+            with glue.lock:
+                datasets = [data for data in session.data_collection if data.ndim == 1]
+                if not datasets:
+                    return
+                data = datasets[report.broadcasts_sent % len(datasets)]
+                layer = data
+                if report.broadcasts_sent % 2 == 1:
+                    # Subsets are created for all datasets but only the ones
+                    # defined on this dataset can be sent as row lists.
+                    for subset in data.subsets:
+                        try:
+                            subset.to_mask()
+                        except IncompatibleAttribute:
+                            continue
+                        layer = subset
+                        break
+                glue.send_data(layer=layer)
+            report.broadcasts_sent += 1
+
+        def sample_memory():
+            if trace_memory:
+                report.memory.append(tracemalloc.get_traced_memory()[0])
+
+        stop = threading.Event()
+        broadcaster = threading.Thread(target=_every,
+                                       args=(1. / broadcast_rate, stop, broadcast, report))
+        broadcaster.daemon = True
+
+        connection.send(glue.client.get_public_id())
+
+        start = time.time()
+
+        broadcaster.start()
+        while time.time() - start < duration:
+            sample_memory()
+            time.sleep(min(memory_interval, max(0., duration - (time.time() - start))))
+        sample_memory()
+
+        stop.set()
+        broadcaster.join(timeout + 1)
+
+        connection.send(report.broadcasts_sent)
+        report.duration = time.time() - start
+
+        results = _receive(connection, 3 * timeout + 30)
+        report.errors += results.pop('errors')
+        for key, value in results.items():
+            setattr(report, key, value)
+
+        report.n_datasets = len(session.data_collection)
+
+    finally:
+        if glue is not None:
+            glue.unregister()
+            glue.stop_samp()
+        if trace_memory:
+            tracemalloc.stop()
+        connection.send('stop')
+        process.join(timeout)
+        shutil.rmtree(tmpdir)
+
+    return report
+
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(description='Run a SAMP load test against glue')
+    parser.add_argument('--peers', type=int, default=5,
+                        help='number of peers sending messages to glue')
+    parser.add_argument('--duration', type=float, default=10.,
+                        help='duration of the test in seconds')
+    parser.add_argument('--rate', type=float, default=5.,
+                        help='messages per second sent by each peer')
+    parser.add_argument('--broadcast-rate', type=float, default=1.,
+                        help='broadcasts per second sent by glue')
+    parser.add_argument('--churn-rate', type=float, default=1.,
+                        help='client register/unregister cycles per second')
+    parser.add_argument('--tables', type=int, default=5,
+                        help='number of distinct tables sent to glue')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='number of rows in each table')
+    parser.add_argument('--timeout', type=int, default=10,
+                        help='timeout in seconds for calls to glue')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace memory used by glue (slows down glue)')
+    args = parser.parse_args(args)
+
+    report = run_load_test(peers=args.peers, duration=args.duration, rate=args.rate,
+                           broadcast_rate=args.broadcast_rate, churn_rate=args.churn_rate,
+                           n_tables=args.tables, n_rows=args.rows, timeout=args.timeout,
+                           trace_memory=args.trace_memory)
+
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+
+from astropy.wcs import WCS
+
+from glue.core import Data, DataCollection
+from glue.core.state import GlueSerializer, GlueUnSerializer
+
+from .. import export_cache
+from ..export_cache import data_fingerprint, values_equal, cached_export, EXPORT_FILENAME
+
+
+def write_text(filename, data):
+    with open(filename, 'w') as f:
+        f.write(str(data['x'].tolist()))
+
+
+def compare_text(filename, data):
+    with open(filename) as f:
+        return f.read() == str(data['x'].tolist())
+
+
+def no_fingerprint(*args, **kwargs):
+    raise AssertionError('data_fingerprint should not be called')
+
+
+def test_data_fingerprint():
+
+    data1 = Data(x=[1, 2, 3], y=['a', 'b', 'c'], label='data1')
+    data2 = Data(x=[1, 2, 3], y=['a', 'b', 'c'], label='data2')
+
+    # The label isn't included since it isn't part of the exported file
+    assert data_fingerprint(data1) == data_fingerprint(data2)
+    assert data_fingerprint(data1, fmt='votable') != data_fingerprint(data1, fmt='fits')
+
+    data2.update_components({data2.id['x']: np.array([1, 2, 4])})
+    assert data_fingerprint(data1) != data_fingerprint(data2)
+
+    data3 = Data(x=[1, 2, 3], y=['a', 'b', 'd'], label='data3')
+    assert data_fingerprint(data1) != data_fingerprint(data3)
+
+
+def test_data_fingerprint_units():
+    data1 = Data(x=[1, 2, 3], label='data1')
+    data2 = Data(x=[1, 2, 3], label='data2')
+    data2.get_component('x').units = 'm'
+    assert data_fingerprint(data1) != data_fingerprint(data2)
+
+
+def test_data_fingerprint_wcs():
+
+    wcs = WCS(naxis=2)
+    data1 = Data(a=np.ones((2, 3)), coords=wcs)
+    fingerprint1 = data_fingerprint(data1)
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.crval = [1, 2]
+    data2 = Data(a=np.ones((2, 3)), coords=wcs)
+
+    assert data_fingerprint(data2) != fingerprint1
+
+
+def test_values_equal():
+    assert values_equal([1, 2, np.nan], [1, 2, np.nan])
+    assert values_equal([1, 2, 3], [1., 2., 3.])
+    assert values_equal(np.array(['a', 'b'], dtype=object), np.array([b'a', b'b']))
+    assert not values_equal([1, 2, np.nan], [1, 2, 3])
+    assert not values_equal([1, 2, 3], [1, 2])
+    assert not values_equal(['a', 'b'], ['a', 'c'])
+
+
+def test_cached_export():
+
+    data = Data(x=[1, 2, 3], label='data')
+
+    filename1 = cached_export(data, write_text, 'text', compare=compare_text)
+    assert data.meta[EXPORT_FILENAME] == filename1
+
+    # Unchanged data should not be written out again
+    assert cached_export(data, write_text, 'text', compare=compare_text) == filename1
+
+    # But a different format should
+    filename2 = cached_export(data, write_text, 'other', compare=compare_text)
+    assert filename2 != filename1
+
+    # As should modified data
+    data.update_components({data.id['x']: np.array([1, 2, 4])})
+    filename3 = cached_export(data, write_text, 'other', compare=compare_text)
+    assert filename3 != filename2
+
+    # Or a file that was changed or removed
+    with open(filename3, 'a') as f:
+        f.write('more')
+    filename4 = cached_export(data, write_text, 'other', compare=compare_text)
+    assert filename4 != filename3
+    os.remove(filename4)
+    filename5 = cached_export(data, write_text, 'other', compare=compare_text)
+    assert filename5 != filename4
+    assert os.path.exists(filename5)
+
+    # If the file can't be compared to the data, it is written out again
+    filename6 = cached_export(data, write_text, 'other')
+    assert filename6 != filename5
+
+
+def test_cached_export_no_hashing(monkeypatch):
+
+    # The values should not be hashed when writing out files, or when the
+    # caller knows that the data is unchanged.
+
+    monkeypatch.setattr(export_cache, 'data_fingerprint', no_fingerprint)
+
+    data = Data(x=[1, 2, 3], label='data')
+
+    filename1 = cached_export(data, write_text, 'text')
+    assert cached_export(data, write_text, 'text', unchanged=True) == filename1
+
+    data.update_components({data.id['x']: np.array([1, 2, 4])})
+    filename2 = cached_export(data, write_text, 'text')
+    assert filename2 != filename1
+
+
+def test_cached_export_unchanged():
+
+    data = Data(x=[1, 2, 3], label='data')
+
+    filename1 = cached_export(data, write_text, 'text')
+    assert cached_export(data, write_text, 'text', unchanged=True) == filename1
+
+    # Changes that don't involve the values are still detected
+
+    data.get_component('x').units = 'm'
+    filename2 = cached_export(data, write_text, 'text', unchanged=True)
+    assert filename2 != filename1
+
+
+def test_cached_export_session_restore():
+
+    data = Data(x=[1, 2, 3], label='data')
+    data.meta['samp-table-id'] = 'table-123'
+
+    filename = cached_export(data, write_text, 'text')
+
+    state = GlueSerializer(DataCollection([data])).dumps()
+    data_restored = GlueUnSerializer.loads(state).object('__main__')[0]
+
+    assert data_restored.meta['samp-table-id'] == 'table-123'
+    assert cached_export(data_restored, write_text, 'text', compare=compare_text) == filename
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+
+from astropy.io import fits
+
+from ..fingerprint import url_fingerprint, CHUNK_SIZE, SAMPLE_SIZE, _sample_offsets
+
+
+def write(filename, content):
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return 'file://' + os.path.abspath(filename)
+
+
+def test_url_fingerprint_local(tmpdir):
+
+    url1 = write(tmpdir.join('file1').strpath, b'abcdef')
+    url2 = write(tmpdir.join('file2').strpath, b'abcdef')
+    url3 = write(tmpdir.join('file3').strpath, b'abcdeg')
+
+    # The fingerprint depends on the content and not the location
+    assert url_fingerprint(url1) == url_fingerprint(url2)
+    assert url_fingerprint(url1) != url_fingerprint(url3)
+
+    # and on the message type
+    assert url_fingerprint(url1, mtype='table.load.fits') != url_fingerprint(url1)
+
+
+def test_url_fingerprint_large(tmpdir):
+
+    size = 2 * CHUNK_SIZE + 64 * SAMPLE_SIZE
+    content = b'a' * size
+
+    url1 = write(tmpdir.join('file1').strpath, content)
+
+    def modified(index):
+        return content[:index] + b'b' + content[index + 1:]
+
+    # Differences at the end of the file are detected
+    url2 = write(tmpdir.join('file2').strpath, modified(size - 1))
+    assert url_fingerprint(url1) != url_fingerprint(url2)
+
+    # as well as differences in the chunks read from the middle of the file
+    offsets = _sample_offsets(size)
+    url3 = write(tmpdir.join('file3').strpath, modified(offsets[8] + 10))
+    assert url_fingerprint(url1) != url_fingerprint(url3)
+
+    # But the rest of large files is not read
+    url4 = write(tmpdir.join('file4').strpath, modified(offsets[8] + SAMPLE_SIZE + 10))
+    assert url_fingerprint(url1) == url_fingerprint(url4)
+
+
+def test_url_fingerprint_fits_header(tmpdir):
+
+    # Headers of extensions that are not in any of the chunks read should
+    # still be taken into account.
+
+    size = 2 * CHUNK_SIZE + 64 * SAMPLE_SIZE
+
+    def write_fits(filename, value):
+        hdus = fits.HDUList([fits.PrimaryHDU(np.zeros(size // 8)),
+                             fits.ImageHDU(np.zeros(size // 8)),
+                             fits.ImageHDU(np.zeros(size // 8))])
+        hdus[1].header['TEST'] = value
+        hdus.writeto(filename)
+        return 'file://' + os.path.abspath(filename)
+
+    url1 = write_fits(tmpdir.join('file1.fits').strpath, 1)
+    url2 = write_fits(tmpdir.join('file2.fits').strpath, 1)
+    url3 = write_fits(tmpdir.join('file3.fits').strpath, 2)
+
+    assert url_fingerprint(url1) == url_fingerprint(url2)
+    assert url_fingerprint(url1) != url_fingerprint(url3)
+
+
+def test_url_fingerprint_votable_header(tmpdir):
+
+    header = b'<?xml version="1.0"?>\n<VOTABLE>\n' + b' ' * (3 * CHUNK_SIZE)
+    data = b'<DATA></DATA>\n' + b' ' * (64 * SAMPLE_SIZE) + b'</VOTABLE>\n'
+    content = header + data
+
+    # Modify the header in a place that is not in any of the chunks read
+    index = _sample_offsets(len(content))[1] - 10
+    modified = content[:index] + b'x' + content[index + 1:]
+
+    url1 = write(tmpdir.join('file1.xml').strpath, content)
+    url2 = write(tmpdir.join('file2.xml').strpath, modified)
+
+    assert url_fingerprint(url1) != url_fingerprint(url2)
+
+
+def test_url_fingerprint_remote():
+    assert (url_fingerprint('http://www.glueviz.org/data.xml') ==
+            url_fingerprint('http://www.glueviz.org/data.xml'))
+    assert (url_fingerprint('http://www.glueviz.org/data.xml') !=
+            url_fingerprint('http://www.glueviz.org/other.xml'))
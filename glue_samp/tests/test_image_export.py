@@ -0,0 +1,154 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_equal, assert_allclose
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from glue.core import Data
+
+from ..image_export import image_writer, downsample_factor
+
+
+def make_wcs(naxis):
+    wcs = WCS(naxis=naxis)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN', 'FREQ'][:naxis]
+    wcs.wcs.crval = [10., 20., 1e9][:naxis]
+    wcs.wcs.crpix = [3., 4., 1.][:naxis]
+    wcs.wcs.cdelt = [-0.01, 0.01, 1e6][:naxis]
+    return wcs
+
+
+def test_downsample_factor():
+    assert downsample_factor((100, 50), None) == 1
+    assert downsample_factor((100, 50), 200) == 1
+    assert downsample_factor((100, 50), 50) == 2
+    assert downsample_factor((101, 50), 50) == 3
+
+
+def test_full_image(tmpdir):
+    filename = tmpdir.join('test.fits').strpath
+    data = Data(a=np.arange(12).reshape((3, 4)))
+    image_writer(filename, data)
+    assert_equal(fits.getdata(filename), data['a'])
+
+
+@pytest.mark.parametrize('method', ['block', 'stride'])
+def test_downsample(tmpdir, method):
+
+    filename = tmpdir.join('test.fits').strpath
+
+    values = np.arange(120.).reshape((10, 12))
+    wcs = make_wcs(2)
+    data = Data(a=values, coords=wcs)
+
+    image_writer(filename, data, max_size=5, method=method)
+
+    hdu = fits.open(filename)[0]
+
+    if method == 'block':
+        expected = values[:9].reshape((3, 3, 4, 3)).mean(axis=(1, 3))
+        centre = (1, 1)
+    else:
+        expected = values[::3, ::3]
+        centre = (0, 0)
+
+    assert_equal(hdu.data, expected)
+
+    # The new WCS should give the world coordinates of the centre of the
+    # first block of pixels, or of the first pixel that was kept.
+    new_wcs = WCS(hdu.header)
+    assert_allclose(new_wcs.wcs_pix2world([[0, 0]], 0),
+                    wcs.wcs_pix2world([centre], 0))
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.int16])
+def test_block_chunks(tmpdir, monkeypatch, dtype):
+
+    # Make sure that averaging in chunks gives the same result as averaging
+    # the whole image at once, and that floating-point types are preserved.
+
+    from .. import image_export
+    monkeypatch.setattr(image_export, 'BLOCK_CHUNK_SIZE', 20)
+
+    filename = tmpdir.join('test.fits').strpath
+    values = np.arange(14 * 9).reshape((14, 9)).astype(dtype)
+    image_writer(filename, Data(a=values), max_size=5)
+
+    result = fits.getdata(filename)
+    expected = values[:12].reshape((4, 3, 3, 3)).astype(float).mean(axis=(1, 3))
+    assert_allclose(result, expected)
+    expected_dtype = np.dtype(dtype if dtype != np.int16 else np.float64)
+    assert result.dtype.kind == expected_dtype.kind
+    assert result.dtype.itemsize == expected_dtype.itemsize
+
+
+def test_block_nan(tmpdir):
+    filename = tmpdir.join('test.fits').strpath
+    values = np.ones((4, 4))
+    values[:2, :2] = np.nan
+    values[2, 2] = np.nan
+    image_writer(filename, Data(a=values), max_size=2)
+    assert_equal(fits.getdata(filename), [[np.nan, 1], [1, 1]])
+
+
+def test_cube_slice(tmpdir):
+
+    filename = tmpdir.join('test.fits').strpath
+
+    values = np.random.random((5, 6, 7))
+    wcs = make_wcs(3)
+    data = Data(a=values, coords=wcs)
+
+    image_writer(filename, data, slices=(2, slice(None), slice(None)))
+
+    hdu = fits.open(filename)[0]
+    assert_equal(hdu.data, values[2])
+
+    new_wcs = WCS(hdu.header)
+    assert new_wcs.naxis == 2
+    assert_allclose(new_wcs.wcs_pix2world([[1, 2]], 0),
+                    wcs.wcs_pix2world([[1, 2, 0]], 0)[:, :2])
+
+
+@pytest.mark.parametrize('celestial', [False, True])
+def test_cube_slice_other_axis(tmpdir, celestial):
+
+    filename = tmpdir.join('test.fits').strpath
+
+    values = np.random.random((5, 6, 7))
+    wcs = make_wcs(3)
+    if not celestial:
+        wcs.wcs.ctype = ['X', 'Y', 'Z']
+    data = Data(a=values, coords=wcs)
+
+    image_writer(filename, data, slices=(slice(None), slice(None), 3))
+
+    hdu = fits.open(filename)[0]
+    assert_equal(hdu.data, values[:, :, 3])
+
+    # Dropping one of the celestial axes can't be represented in the FITS WCS
+    # so in this case the image is written out without WCS.
+    if celestial:
+        assert 'CTYPE1' not in hdu.header
+        return
+
+    new_wcs = WCS(hdu.header)
+    assert new_wcs.naxis == 2
+    assert_allclose(new_wcs.wcs_pix2world([[1, 2]], 0),
+                    wcs.wcs_pix2world([[3, 1, 2]], 0)[:, 1:])
+
+
+def test_invalid(tmpdir):
+    filename = tmpdir.join('test.fits').strpath
+    data = Data(a=np.ones((2, 3, 4)))
+    with pytest.raises(ValueError) as exc:
+        image_writer(filename, data)
+    assert exc.value.args[0] == 'slices should keep exactly two dimensions'
+    with pytest.raises(ValueError) as exc:
+        image_writer(filename, data, slices=(0, slice(None)))
+    assert exc.value.args[0] == 'slices should have one entry per dimension (3)'
+    with pytest.raises(ValueError) as exc:
+        image_writer(filename, data, slices=(0, slice(None), slice(None)), method='spline')
+    assert exc.value.args[0] == 'method should be one of block/stride'
@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+import numpy as np
+
+from .load_harness import LoadReport, run_load_test, main, _every
+
+# These tests depend on timing and on how busy the machine is, so they are
+# only run if explicitly requested.
+load_test = pytest.mark.skipif(not os.environ.get('GLUE_SAMP_LOAD_TESTS'),
+                               reason='set GLUE_SAMP_LOAD_TESTS=1 to run load tests')
+
+
+@load_test
+def test_run_load_test():
+
+    report = run_load_test(peers=2, duration=2., rate=5., broadcast_rate=2.,
+                           churn_rate=2., n_tables=2, n_rows=10)
+
+    assert report.sent > 0
+    assert report.failed == 0
+    assert report.throughput > 0
+    assert report.n_datasets == 2
+    assert report.churn > 0
+    assert report.broadcasts_sent > 0
+    assert report.dropped_broadcasts == 0
+    assert report.errors == 0
+    assert report.memory_growth is None
+
+    percentiles = report.latency_percentiles()
+    assert np.all(np.isfinite(list(percentiles.values())))
+
+    assert 'Throughput' in str(report)
+
+
+@load_test
+def test_run_load_test_memory():
+
+    report = run_load_test(peers=1, duration=2., rate=5., n_tables=1, n_rows=10,
+                           trace_memory=True, memory_interval=0.5)
+
+    assert len(report.memory) > 2
+    assert report.memory_growth is not None
+    assert 'Memory' in str(report)
+
+
+def test_every_errors():
+
+    # Errors should be counted without stopping the calls
+
+    report = LoadReport()
+    stop = threading.Event()
+    calls = []
+
+    def function():
+        calls.append(None)
+        if len(calls) == 3:
+            stop.set()
+        raise ValueError()
+
+    _every(0.01, stop, function, report)
+
+    assert len(calls) == 3
+    assert report.errors == 3
+    assert 'Errors in broadcasts and register/unregister cycles: 3' in str(report)
+
+
+def test_main(capsys):
+    # This only checks that the harness runs, not the results
+    main(['--peers', '1', '--duration', '1', '--tables', '1', '--rows', '10'])
+    out, err = capsys.readouterr()
+    assert 'Messages sent' in out
@@ -19,6 +19,7 @@ from glue.core import Data, DataCollection, Session
 from glue.core.subset import ElementSubsetState
 
 from ..samp_state import SAMPState
+from .. import export_cache, samp_client
 from ..samp_client import SAMPClient
 
 
@@ -111,6 +112,18 @@ class TestSAMPClientConnectSend(WaitMixin):
 
         receiver.reset_mock()
 
+        # Sending unchanged data again should re-use the existing file
+
+        url = args[4]['url']
+        self.client.send_data(layer=data1d, client=self.client_ext.get_public_id())
+
+        self.wait(lambda x: len(receiver.call_args_list) == 1)
+
+        args, kwargs = receiver.call_args_list[-1]
+        assert args[4]['url'] == url
+
+        receiver.reset_mock()
+
         data2d = Data(a=[[1, 2], [3, 4]])
         self.client.send_data(layer=data2d)
 
@@ -139,6 +152,213 @@ class TestSAMPClientConnectSend(WaitMixin):
 
         assert_equal(args[4]['row-list'], ['0', '2'])
 
+    def test_send_data_export_cache(self, monkeypatch):
+
+        receiver = MagicMock()
+
+        def receiver_func(private_key, sender_id, msg_id, mtype, params, extra):
+            receiver(params['url'])
+
+        self.client.start_samp()
+
+        self.client_ext.connect()
+        self.client_ext.bind_receive_notification('table.load.votable', receiver_func)
+        self.client_ext.bind_receive_notification('image.load.fits', receiver_func)
+        client_id = self.client_ext.get_public_id()
+
+        # The values should never be hashed when sending data
+
+        def fingerprint(*args, **kwargs):
+            raise AssertionError('data_fingerprint should not be called')
+
+        monkeypatch.setattr(export_cache, 'data_fingerprint', fingerprint)
+
+        table = Data(x=[1, 2, np.nan], y=['a', 'b', 'c'], label='table')
+        image = Data(a=np.arange(6.).reshape((2, 3)), b=np.ones((2, 3), dtype=int),
+                     label='image')
+        self.data_collection.append(table)
+        self.data_collection.append(image)
+
+        for data in (table, image):
+
+            self.client.send_data(layer=data, client=client_id)
+
+            # Unchanged data in the data collection should not be compared
+            # to the cached file
+
+            with monkeypatch.context() as m:
+                m.setattr(samp_client, 'votable_matches', None)
+                m.setattr(samp_client, 'fits_matches', None)
+                self.client.send_data(layer=data, client=client_id)
+
+            # Data that may have changed (for example in a restored session)
+            # should be compared to the cached file once
+
+            self.client._data_listener.unchanged_data.discard(data)
+            self.client.send_data(layer=data, client=client_id)
+            assert data in self.client._data_listener.unchanged_data
+
+        # But changes to the values should be picked up
+
+        table.update_components({table.id['x']: np.array([1, 2, 4])})
+        self.client.send_data(layer=table, client=client_id)
+
+        self.wait(lambda x: len(receiver.call_args_list) == 7)
+
+        urls = [args[0] for args, kwargs in receiver.call_args_list]
+        assert urls[0] == urls[1] == urls[2]
+        assert urls[3] == urls[4] == urls[5]
+        assert urls[6] != urls[0]
+
+        t = Table.read(urls[6], format='votable')
+        assert_equal(t['x'], [1, 2, 4])
+
+    def test_send_data_to_clients(self):
+
+        receiver = MagicMock()
+
+        def receiver_func(private_key, sender_id, msg_id, mtype, params, extra):
+            receiver(sender_id, mtype, params)
+
+        self.client.start_samp()
+
+        self.client_ext.connect()
+        self.client_ext.bind_receive_notification('table.load.votable', receiver_func)
+
+        client_ext2 = SAMPIntegratedClient()
+        client_ext2.connect()
+        client_ext2.bind_receive_notification('table.*', receiver_func)
+
+        # This client isn't subscribed to table.load.votable
+        client_ext3 = SAMPIntegratedClient()
+        client_ext3.connect()
+        client_ext3.bind_receive_notification('image.load.fits', receiver_func)
+
+        try:
+
+            clients = [self.client_ext.get_public_id(),
+                       client_ext2.get_public_id(),
+                       client_ext3.get_public_id(),
+                       'cli#missing']
+
+            data1d = Data(x=[1, 2, 3])
+            results = self.client.send_data_to_clients(layer=data1d, clients=clients)
+
+            assert results[clients[0]] == (True, None)
+            assert results[clients[1]] == (True, None)
+            assert results[clients[2]] == (False, 'Client is not subscribed to table.load.votable')
+            assert not results[clients[3]][0]
+
+            self.wait(lambda x: len(receiver.call_args_list) == 2)
+
+            # The data should only have been written out once
+            urls = set(args[2]['url'] for args, kwargs in receiver.call_args_list)
+            assert len(urls) == 1
+
+            assert self.client.send_data_to_clients(layer=data1d, clients=[]) == {}
+
+        finally:
+            client_ext2.disconnect()
+            client_ext3.disconnect()
+
+    def test_send_cube_slice(self):
+
+        receiver = MagicMock()
+
+        def receiver_func(private_key, sender_id, msg_id, mtype, params, extra):
+            receiver(private_key, sender_id, msg_id, mtype, params, extra)
+
+        self.client.start_samp()
+
+        self.client_ext.connect()
+        self.client_ext.bind_receive_notification('*', receiver_func)
+
+        self.wait(lambda x: len(receiver.call_args_list) == 1)
+        receiver.reset_mock()
+
+        data3d = Data(a=np.arange(24).reshape((2, 3, 4)))
+
+        # Cubes are sent one slice at a time, defaulting to the first plane
+        self.client.send_data(layer=data3d)
+
+        self.wait(lambda x: len(receiver.call_args_list) == 1)
+
+        args, kwargs = receiver.call_args_list[-1]
+        assert args[3] == 'image.load.fits'
+
+        hdu = fits.open(args[4]['url'])[0]
+        assert_equal(hdu.data, np.arange(12).reshape((3, 4)))
+
+        receiver.reset_mock()
+
+        self.client.send_data(layer=data3d, slices=(1, slice(None), slice(None)), max_size=2)
+
+        self.wait(lambda x: len(receiver.call_args_list) == 1)
+
+        args, kwargs = receiver.call_args_list[-1]
+        assert args[3] == 'image.load.fits'
+        assert 'samp-image-id' not in data3d.meta
+
+        hdu = fits.open(args[4]['url'])[0]
+        assert_equal(hdu.data, [[14.5, 16.5]])
+
+
+def test_stop_samp_stops_worker():
+
+    client = SAMPClient(state=SAMPState(), session=Session())
+    client.start_samp()
+    client.register()
+
+    client_ext = SAMPIntegratedClient()
+    client_ext.connect()
+
+    try:
+        message = {'samp.mtype': 'table.highlight.row',
+                   'samp.params': {'table-id': 'table-123', 'row': '1'}}
+        client_ext.call_and_wait(client.client.get_public_id(), message, '10')
+        worker = client._worker
+        assert worker.is_alive()
+    finally:
+        client_ext.disconnect()
+        client.stop_samp()
+
+    worker.join(5)
+    assert not worker.is_alive()
+
+
+def test_no_worker_with_custom_handlers():
+
+    # Sub-classes that override the receive_* methods (as the Qt client does)
+    # should not start a worker thread.
+
+    class CustomSAMPClient(SAMPClient):
+
+        def receive_call(self, private_key, sender_id, msg_id, mtype, params, extra):
+            self.received.append(mtype)
+            self.client.reply(msg_id, {"samp.status": "samp.ok", "samp.result": {}})
+
+        def receive_notification(self, private_key, sender_id, msg_id, mtype, params, extra):
+            self.received.append(mtype)
+
+    client = CustomSAMPClient(state=SAMPState(), session=Session())
+    client.received = []
+    client.start_samp()
+    client.register()
+
+    client_ext = SAMPIntegratedClient()
+    client_ext.connect()
+
+    try:
+        message = {'samp.mtype': 'table.highlight.row',
+                   'samp.params': {'table-id': 'table-123', 'row': '1'}}
+        client_ext.call_and_wait(client.client.get_public_id(), message, '10')
+        assert 'table.highlight.row' in client.received
+        assert client._message_queue is None
+    finally:
+        client_ext.disconnect()
+        client.unregister()
+        client.stop_samp()
+
 
 class TestSAMPClientReceive(WaitMixin):
 
@@ -187,6 +407,120 @@ class TestSAMPClientReceive(WaitMixin):
         assert_equal(self.data_collection[0]['a'], [1, 2, 3])
         assert self.data_collection[0].label == 'test_table'
 
+    def test_receive_call_reply(self, tmpdir):
+
+        filename = tmpdir.join('test').strpath
+        t = Table()
+        t['a'] = [1, 2, 3]
+        t.write(filename, format='votable')
+
+        message = {}
+        message['samp.mtype'] = 'table.load.votable'
+        message['samp.params'] = {}
+        message['samp.params']['url'] = 'file://' + os.path.abspath(filename)
+        message['samp.params']['table-id'] = 'testing'
+
+        glue_id = self.client.client.get_public_id()
+
+        # The reply should only be sent once the table has been read in
+        response = self.client_ext.call_and_wait(glue_id, message, '10')
+        assert response['samp.status'] == 'samp.ok'
+        assert len(self.data_collection) == 1
+
+        # Errors while processing should be reported back to the caller
+        message['samp.params']['url'] = 'file://' + os.path.abspath(filename) + '.missing'
+        message['samp.params']['table-id'] = 'testing-missing'
+        response = self.client_ext.call_and_wait(glue_id, message, '10')
+        assert response['samp.status'] == 'samp.error'
+        assert 'samp.errortxt' in response['samp.error']
+        assert len(self.data_collection) == 1
+
+    @pytest.mark.parametrize('deduplicate', [False, True])
+    def test_receive_duplicate_content(self, tmpdir, deduplicate):
+
+        self.state.deduplicate_by_content = deduplicate
+
+        t = Table()
+        t['a'] = [1, 2, 3]
+        filenames = [tmpdir.join('test1').strpath, tmpdir.join('test2').strpath]
+        for filename in filenames:
+            t.write(filename, format='votable')
+
+        glue_id = self.client.client.get_public_id()
+
+        # The same table sent from two different locations with different ids
+        for index, filename in enumerate(filenames):
+            message = {}
+            message['samp.mtype'] = 'table.load.votable'
+            message['samp.params'] = {}
+            message['samp.params']['url'] = 'file://' + os.path.abspath(filename)
+            message['samp.params']['table-id'] = 'testing-{0}'.format(index)
+            self.client_ext.call_and_wait(glue_id, message, '10')
+
+        if deduplicate:
+            assert len(self.data_collection) == 1
+            data = self.data_collection[0]
+            assert data.meta['samp-table-id'] == 'testing-0'
+            assert data.meta['samp-table-id-aliases'] == ['testing-1']
+        else:
+            assert len(self.data_collection) == 2
+
+        # Row selections using either id should work
+
+        message = {}
+        message['samp.mtype'] = 'table.select.rowList'
+        message['samp.params'] = {}
+        message['samp.params']['table-id'] = 'testing-1'
+        message['samp.params']['row-list'] = ['0', '2']
+
+        self.client_ext.call_and_wait(glue_id, message, '10')
+
+        data = self.client.data_from_table_id('testing-1')
+        assert_equal(data.subsets[0].to_mask(), [1, 0, 1])
+
+    def test_send_row_list_aliases(self, tmpdir):
+
+        # If a table with the same content is received from an application
+        # with a different table-id, selections should be sent with that
+        # table-id too, since it is the only one the application knows about.
+
+        self.state.deduplicate_by_content = True
+
+        receiver = MagicMock()
+
+        def receiver_func(private_key, sender_id, msg_id, mtype, params, extra):
+            receiver(params['table-id'], params['row-list'])
+
+        self.client_ext.bind_receive_notification('table.select.rowList', receiver_func)
+
+        t = Table()
+        t['a'] = [1, 2, 3]
+        filenames = [tmpdir.join('test1').strpath, tmpdir.join('test2').strpath]
+        for filename in filenames:
+            t.write(filename, format='votable')
+
+        glue_id = self.client.client.get_public_id()
+
+        for index, filename in enumerate(filenames):
+            message = {}
+            message['samp.mtype'] = 'table.load.votable'
+            message['samp.params'] = {}
+            message['samp.params']['url'] = 'file://' + os.path.abspath(filename)
+            message['samp.params']['table-id'] = 'testing-{0}'.format(index)
+            self.client_ext.call_and_wait(glue_id, message, '10')
+
+        assert len(self.data_collection) == 1
+
+        subset = self.data_collection[0].new_subset()
+        subset.subset_state = ElementSubsetState([0, 2])
+
+        self.client.send_data(layer=subset, client=self.client_ext.get_public_id())
+
+        self.wait(lambda x: len(receiver.call_args_list) == 2)
+
+        received = sorted(args for args, kwargs in receiver.call_args_list)
+        assert received == [('testing-0', ['0', '2']), ('testing-1', ['0', '2'])]
+
     def test_receive_image(self, tmpdir):
 
         filename = tmpdir.join('test').strpath